@@ -1,9 +1,254 @@
 import copy
+import functools
 import itertools
+import struct
+import threading
 import time
 
+# 行、列属于“线”，区块删减法按线/非线区分来源
+LINE_KINDS = ('行', '列')
+
+
+class Constraint:
+    """
+    额外约束的基类。变体数独通过组合若干约束构建ConstraintGraph。
+    子类按需覆盖：houses()提供额外的宫（9格，1-9各一次），
+    groups()提供互不相同的格子组（可少于9格），
+    restrict()根据盘面裁剪候选数，is_valid()检查填数是否合法，
+    eliminations()给出回溯搜索中填入一个数后应额外排除的候选。
+    """
+    # 快照中的类型编号，新约束需设置并登记到CONSTRAINT_TYPES才能保存会话
+    CODE = None
+
+    def houses(self):
+        return []
+
+    def groups(self):
+        return []
+
+    def restrict(self, board, candidates):
+        pass
+
+    def is_valid(self, board, i, j, v):
+        return True
+
+    def eliminations(self, board, candidates, i, j, v):
+        """board[i][j]刚填入v，返回由此可排除的[(行, 列, 数字)]（peers之外的部分）。"""
+        return []
+
+    def to_bytes(self):
+        if self.CODE is None:
+            raise ValueError(f'约束{type(self).__name__}不支持快照')
+        return struct.pack('<B', self.CODE)
+
+    @classmethod
+    def _unpack(cls, data, offset):
+        return cls(), offset
+
+
+class Diagonal(Constraint):
+    """对角线数独：两条对角线上1-9各出现一次。"""
+    CODE = 1
+
+    def houses(self):
+        return [('对角线', [(k, k) for k in range(9)]),
+                ('对角线', [(k, 8 - k) for k in range(9)])]
+
+
+class Windoku(Constraint):
+    """窗口数独：第2-4、6-8行与第2-4、6-8列交出的4个窗口内1-9各出现一次。"""
+    CODE = 2
+
+    def houses(self):
+        return [('窗口', [(bi+di, bj+dj) for di in range(3) for dj in range(3)])
+                for bi in (1, 5) for bj in (1, 5)]
+
+
+class KillerCage(Constraint):
+    """杀手数独的笼子：笼内数字互不相同且和为total。"""
+    CODE = 3
+
+    def __init__(self, total, cells):
+        self.total = total
+        self.cells = [tuple(c) for c in cells]
+        if not 1 <= len(self.cells) <= 9 or len(set(self.cells)) != len(self.cells):
+            raise ValueError('笼子必须由1-9个互不相同的格子组成')
+        if any(not (0 <= i < 9 and 0 <= j < 9) for (i, j) in self.cells):
+            raise ValueError('笼子的格子超出9x9盘面')
+        if not 1 <= total <= 45:
+            raise ValueError('笼子的和必须在1-45之间')
+
+    def groups(self):
+        return [self.cells]
+
+    def _possible(self, board):
+        """返回(笼内空格, 这些空格还可能填的数字集合)。"""
+        used = [board[i][j] for (i, j) in self.cells if board[i][j]]
+        empties = [(i, j) for (i, j) in self.cells if not board[i][j]]
+        remain = self.total - sum(used)
+        avail = [v for v in range(1, 10) if v not in used]
+        possible = set()
+        for combo in itertools.combinations(avail, len(empties)):
+            if sum(combo) == remain:
+                possible.update(combo)
+        return empties, possible
+
+    def restrict(self, board, candidates):
+        empties, possible = self._possible(board)
+        for (i, j) in empties:
+            candidates[i][j] &= possible
+
+    def eliminations(self, board, candidates, i, j, v):
+        if (i, j) not in self.cells:
+            return []
+        empties, possible = self._possible(board)
+        return [(ii, jj, d) for (ii, jj) in empties for d in candidates[ii][jj] if d not in possible]
+
+    def is_valid(self, board, i, j, v):
+        if (i, j) not in self.cells:
+            return True
+        filled = [board[ii][jj] for (ii, jj) in self.cells if board[ii][jj] and (ii, jj) != (i, j)]
+        s = sum(filled) + v
+        if len(filled) + 1 == len(self.cells):
+            return s == self.total
+        return s < self.total
+
+    def to_bytes(self):
+        cells = bytes(i*9+j for (i, j) in self.cells)
+        return struct.pack('<BBB', self.CODE, self.total, len(cells)) + cells
+
+    @classmethod
+    def _unpack(cls, data, offset):
+        total, n = struct.unpack_from('<BB', data, offset)
+        offset += 2
+        raw = data[offset:offset+n]
+        if len(raw) != n or any(k >= 81 for k in raw):
+            raise ValueError('快照中的笼子数据无效')
+        cells = [divmod(k, 9) for k in raw]
+        return cls(total, cells), offset + n
+
+
+class NonConsecutive(Constraint):
+    """无连续数独：上下左右相邻格的数字之差不能为1。"""
+    CODE = 4
+
+    @staticmethod
+    def _neighbors(i, j):
+        for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            ii, jj = i + di, j + dj
+            if 0 <= ii < 9 and 0 <= jj < 9:
+                yield ii, jj
+
+    def restrict(self, board, candidates):
+        for i in range(9):
+            for j in range(9):
+                v = board[i][j]
+                if v:
+                    for ii, jj in self._neighbors(i, j):
+                        candidates[ii][jj].discard(v - 1)
+                        candidates[ii][jj].discard(v + 1)
+
+    def is_valid(self, board, i, j, v):
+        for ii, jj in self._neighbors(i, j):
+            if board[ii][jj] and abs(board[ii][jj] - v) == 1:
+                return False
+        return True
+
+    def eliminations(self, board, candidates, i, j, v):
+        return [(ii, jj, d) for ii, jj in self._neighbors(i, j) if not board[ii][jj]
+                for d in (v - 1, v + 1) if d in candidates[ii][jj]]
+
+
+class ConstraintGraph:
+    """
+    编译好的约束图：所有宫（行、列、宫及变体额外的宫）的格子表、
+    每格所属的宫以及每格的相关格（peers）。构建一次后供所有盘面共享。
+    """
+    def __init__(self, constraints=()):
+        self.constraints = list(constraints)
+        self.houses = []
+        self.house_names = []
+        for i in range(9):
+            self._add_house('行', [(i, j) for j in range(9)])
+        for j in range(9):
+            self._add_house('列', [(i, j) for i in range(9)])
+        for bi in range(3):
+            for bj in range(3):
+                self._add_house('宫', [(bi*3+di, bj*3+dj) for di in range(3) for dj in range(3)])
+        for c in self.constraints:
+            for kind, cells in c.houses():
+                self._add_house(kind, cells)
+        self.cell_houses = [[[] for _ in range(9)] for _ in range(9)]
+        for h, cells in enumerate(self.houses):
+            for (i, j) in cells:
+                self.cell_houses[i][j].append(h)
+        groups = list(self.houses)
+        for c in self.constraints:
+            groups.extend(tuple(g) for g in c.groups())
+        peers = [[set() for _ in range(9)] for _ in range(9)]
+        for cells in groups:
+            for (i, j) in cells:
+                peers[i][j].update(cells)
+        self.peers = [[tuple(sorted(peers[i][j] - {(i, j)})) for j in range(9)] for i in range(9)]
+
+    def _add_house(self, kind, cells):
+        idx = sum(1 for (k, _) in self.house_names if k == kind)
+        self.houses.append(tuple(cells))
+        self.house_names.append((kind, idx))
+
+    def house_label(self, h):
+        kind, idx = self.house_names[h]
+        return f"{kind}{idx+1}"
+
+    def is_line(self, h):
+        return self.house_names[h][0] in LINE_KINDS
+
+    def to_bytes(self):
+        return struct.pack('<B', len(self.constraints)) + b''.join(c.to_bytes() for c in self.constraints)
+
+    @staticmethod
+    def _unpack_constraints(data, offset):
+        """从data[offset:]解析约束列表，返回(约束列表, 新offset)。"""
+        (count,) = struct.unpack_from('<B', data, offset)
+        offset += 1
+        constraints = []
+        for _ in range(count):
+            (code,) = struct.unpack_from('<B', data, offset)
+            if code not in CONSTRAINT_TYPES:
+                raise ValueError(f'未知的约束类型: {code}')
+            c, offset = CONSTRAINT_TYPES[code]._unpack(data, offset + 1)
+            constraints.append(c)
+        return constraints, offset
+
+    @staticmethod
+    def from_bytes(data, offset=0):
+        """从data[offset:]解析约束图，返回(graph, 新offset)。最近用过的约束图会被复用。"""
+        _, end = ConstraintGraph._unpack_constraints(data, offset)
+        return _compile_graph(bytes(data[offset:end])), end
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_graph(key):
+    """按序列化的约束编译约束图；缓存有上限，长时间运行也不会无限增长。"""
+    constraints, _ = ConstraintGraph._unpack_constraints(key, 0)
+    return ConstraintGraph(constraints) if constraints else CLASSIC_GRAPH
+
+
+# 候选掩码（第v位表示数字v）到数字表的映射，用于快照还原
+_MASK_DIGITS = tuple(tuple(v for v in range(1, 10) if m >> v & 1) for m in range(1 << 10))
+# 盘面快照：81格数字 + 81格候选掩码
+BOARD_FORMAT = struct.Struct('<81B81H')
+SNAPSHOT_MAGIC = b'SDKS'
+SNAPSHOT_VERSION = 2
+
+# 快照类型编号到约束类的登记表，自定义约束需在此登记
+CONSTRAINT_TYPES = {c.CODE: c for c in (Diagonal, Windoku, KillerCage, NonConsecutive)}
+CLASSIC_GRAPH = ConstraintGraph()
+
+
 class SudokuBoard:
-    def __init__(self, board=None):
+    def __init__(self, board=None, graph=None):
+        self.graph = graph or CLASSIC_GRAPH
         self.board = [[0 for _ in range(9)] for _ in range(9)]
         if board:
             for i in range(9):
@@ -13,19 +258,16 @@ class SudokuBoard:
         self.update_candidates()
 
     def update_candidates(self):
+        peers = self.graph.peers
         for i in range(9):
             for j in range(9):
                 if self.board[i][j] != 0:
                     self.candidates[i][j] = set()
                 else:
                     self.candidates[i][j] = set(range(1, 10))
-                    for k in range(9):
-                        self.candidates[i][j].discard(self.board[i][k])
-                        self.candidates[i][j].discard(self.board[k][j])
-                    bi, bj = i // 3 * 3, j // 3 * 3
-                    for di in range(3):
-                        for dj in range(3):
-                            self.candidates[i][j].discard(self.board[bi+di][bj+dj])
+                    self.candidates[i][j].difference_update([self.board[pi][pj] for (pi, pj) in peers[i][j]])
+        for c in self.graph.constraints:
+            c.restrict(self.board, self.candidates)
 
     def set_cell(self, row, col, value):
         self.board[row][col] = value
@@ -67,7 +309,32 @@ class SudokuBoard:
                 print('-'*32)
 
     def clone(self):
-        return copy.deepcopy(self)
+        # 约束图只读且共享，不随盘面深拷贝
+        return copy.deepcopy(self, {id(self.graph): self.graph})
+
+    def to_bytes(self):
+        """盘面数字与候选掩码的紧凑二进制表示（不含约束图）。"""
+        cells = [v for row in self.board for v in row]
+        masks = [sum(1 << v for v in cand) for row in self.candidates for cand in row]
+        return BOARD_FORMAT.pack(*cells, *masks)
+
+    @staticmethod
+    def unpack_values(data, offset=0):
+        """解析并校验to_bytes格式的数据，返回81个数字加81个候选掩码。"""
+        values = BOARD_FORMAT.unpack_from(data, offset)
+        if max(values[:81]) > 9 or max(values[81:]) >= len(_MASK_DIGITS):
+            raise ValueError('快照中的盘面数据无效')
+        return values
+
+    @classmethod
+    def from_bytes(cls, data, offset=0, graph=None):
+        """按to_bytes的格式直接还原盘面和候选数，不重新推导候选。"""
+        values = cls.unpack_values(data, offset)
+        self = cls.__new__(cls)
+        self.graph = graph or CLASSIC_GRAPH
+        self.board = [list(values[r*9:r*9+9]) for r in range(9)]
+        self.candidates = [[set(_MASK_DIGITS[m]) for m in values[81+r*9:90+r*9]] for r in range(9)]
+        return self
 
     def find_naked_single(self):
         for i in range(9):
@@ -78,222 +345,94 @@ class SudokuBoard:
         return None
 
     def find_hidden_single(self):
-        for i in range(9):
+        typs = {'行': 'row', '列': 'col', '宫': 'box'}
+        for h, cells in enumerate(self.graph.houses):
             for v in range(1, 10):
-                cols = [j for j in range(9) if v in self.candidates[i][j]]
-                if len(cols) == 1 and self.board[i][cols[0]] == 0:
-                    return (i, cols[0], v, 'row')
-        for j in range(9):
-            for v in range(1, 10):
-                rows = [i for i in range(9) if v in self.candidates[i][j]]
-                if len(rows) == 1 and self.board[rows[0]][j] == 0:
-                    return (rows[0], j, v, 'col')
-        for bi in range(3):
-            for bj in range(3):
-                cells = []
-                for di in range(3):
-                    for dj in range(3):
-                        i, j = bi*3+di, bj*3+dj
-                        cells.append((i, j))
-                for v in range(1, 10):
-                    places = [(i, j) for (i, j) in cells if v in self.candidates[i][j]]
-                    if len(places) == 1 and self.board[places[0][0]][places[0][1]] == 0:
-                        return (places[0][0], places[0][1], v, 'box')
+                places = [(i, j) for (i, j) in cells if v in self.candidates[i][j]]
+                if len(places) == 1 and self.board[places[0][0]][places[0][1]] == 0:
+                    kind = self.graph.house_names[h][0]
+                    return (places[0][0], places[0][1], v, typs.get(kind, self.graph.house_label(h)))
         return None
 
     def find_naked_pairs(self):
-        # 行
-        for i in range(9):
-            pairs = [(j, self.candidates[i][j]) for j in range(9) if len(self.candidates[i][j]) == 2]
-            seen = {}
-            for j, cand in pairs:
-                key = tuple(sorted(cand))
-                if key in seen:
-                    j2 = seen[key]
-                    affected = []
-                    for jj in range(9):
-                        if jj != j and jj != j2 and not self.board[i][jj] and (self.candidates[i][jj] & set(key)):
-                            for v in key:
-                                if v in self.candidates[i][jj]:
-                                    affected.append((i, jj, v))
-                                    self.candidates[i][jj].discard(v)
-                    if affected:
-                        return ("行", i, [(i, j), (i, j2)], key, affected)
-                else:
-                    seen[key] = j
-        # 列
-        for j in range(9):
-            pairs = [(i, self.candidates[i][j]) for i in range(9) if len(self.candidates[i][j]) == 2]
+        for h, cells in enumerate(self.graph.houses):
             seen = {}
-            for i, cand in pairs:
-                key = tuple(sorted(cand))
+            for (i, j) in cells:
+                if len(self.candidates[i][j]) != 2:
+                    continue
+                key = tuple(sorted(self.candidates[i][j]))
                 if key in seen:
-                    i2 = seen[key]
+                    i2, j2 = seen[key]
                     affected = []
-                    for ii in range(9):
-                        if ii != i and ii != i2 and not self.board[ii][j] and (self.candidates[ii][j] & set(key)):
+                    for (ii, jj) in cells:
+                        if (ii, jj) != (i, j) and (ii, jj) != (i2, j2) and not self.board[ii][jj] and (self.candidates[ii][jj] & set(key)):
                             for v in key:
-                                if v in self.candidates[ii][j]:
-                                    affected.append((ii, j, v))
-                                    self.candidates[ii][j].discard(v)
+                                if v in self.candidates[ii][jj]:
+                                    affected.append((ii, jj, v))
+                                    self.candidates[ii][jj].discard(v)
                     if affected:
-                        return ("列", j, [(i, j), (i2, j)], key, affected)
+                        scope, idx = self.graph.house_names[h]
+                        return (scope, idx, [(i, j), (i2, j2)], key, affected)
                 else:
-                    seen[key] = i
-        # 宫
-        for bi in range(3):
-            for bj in range(3):
-                cells = []
-                for di in range(3):
-                    for dj in range(3):
-                        i, j = bi*3+di, bj*3+dj
-                        if len(self.candidates[i][j]) == 2:
-                            cells.append((i, j, tuple(sorted(self.candidates[i][j]))))
-                seen = {}
-                for idx, (i, j, key) in enumerate(cells):
-                    if key in seen:
-                        i2, j2, _ = cells[seen[key]]
-                        affected = []
-                        for di in range(3):
-                            for dj in range(3):
-                                ii, jj = bi*3+di, bj*3+dj
-                                if (ii, jj) != (i, j) and (ii, jj) != (i2, j2) and not self.board[ii][jj] and (self.candidates[ii][jj] & set(key)):
-                                    for v in key:
-                                        if v in self.candidates[ii][jj]:
-                                            affected.append((ii, jj, v))
-                                            self.candidates[ii][jj].discard(v)
-                        if affected:
-                            return ("宫", bi*3+bj, [(i, j), (i2, j2)], key, affected)
-                    else:
-                        seen[key] = idx
+                    seen[key] = (i, j)
         return None
 
     def find_hidden_pairs(self):
-        # 行
-        for i in range(9):
-            for a in range(1, 10):
-                for b in range(a+1, 10):
-                    pos_a = [j for j in range(9) if a in self.candidates[i][j]]
-                    pos_b = [j for j in range(9) if b in self.candidates[i][j]]
-                    if len(pos_a) == 2 and len(pos_b) == 2 and set(pos_a) == set(pos_b):
-                        changed = []
-                        for j in pos_a:
-                            orig = set(self.candidates[i][j])
-                            if orig != set([a, b]):
-                                self.candidates[i][j].intersection_update([a, b])
-                                changed.append((i, j, orig))
-                        if changed:
-                            return ("行", i, [(i, j) for j in pos_a], (a, b), changed)
-        # 列
-        for j in range(9):
+        for h, cells in enumerate(self.graph.houses):
+            positions = {v: [(i, j) for (i, j) in cells if v in self.candidates[i][j]] for v in range(1, 10)}
             for a in range(1, 10):
+                if len(positions[a]) != 2:
+                    continue
                 for b in range(a+1, 10):
-                    pos_a = [i for i in range(9) if a in self.candidates[i][j]]
-                    pos_b = [i for i in range(9) if b in self.candidates[i][j]]
-                    if len(pos_a) == 2 and len(pos_b) == 2 and set(pos_a) == set(pos_b):
-                        changed = []
-                        for i in pos_a:
-                            orig = set(self.candidates[i][j])
-                            if orig != set([a, b]):
-                                self.candidates[i][j].intersection_update([a, b])
-                                changed.append((i, j, orig))
-                        if changed:
-                            return ("列", j, [(i, j) for i in pos_a], (a, b), changed)
-        # 宫
-        for bi in range(3):
-            for bj in range(3):
-                cells = [(bi*3+di, bj*3+dj) for di in range(3) for dj in range(3)]
-                for a in range(1, 10):
-                    for b in range(a+1, 10):
-                        pos_a = [(i, j) for (i, j) in cells if a in self.candidates[i][j]]
-                        pos_b = [(i, j) for (i, j) in cells if b in self.candidates[i][j]]
-                        if len(pos_a) == 2 and len(pos_b) == 2 and set(pos_a) == set(pos_b):
-                            changed = []
-                            for (i, j) in pos_a:
-                                orig = set(self.candidates[i][j])
-                                if orig != set([a, b]):
-                                    self.candidates[i][j].intersection_update([a, b])
-                                    changed.append((i, j, orig))
-                            if changed:
-                                return ("宫", bi*3+bj, pos_a, (a, b), changed)
-        return None
-    
-
-    def find_pointing_pairs_triples(self):
-        for bi in range(3):
-            for bj in range(3):
-                cells = [(bi*3+di, bj*3+dj) for di in range(3) for dj in range(3)]
-                for v in range(1, 10):
-                    positions = [(i, j) for (i, j) in cells if v in self.candidates[i][j]]
-                    if not positions:
+                    if positions[b] != positions[a]:
                         continue
-                    rows = set(i for (i, j) in positions)
-                    if len(rows) == 1:
-                        row = next(iter(rows))
-                        affected = []
-                        for j2 in range(9):
-                            if (row, j2) not in positions and (row//3 == bi and j2//3 == bj):
-                                continue
-                            if (row, j2) not in positions and v in self.candidates[row][j2] and j2//3 != bj:
-                                self.candidates[row][j2].discard(v)
-                                affected.append((row, j2))
-                        if affected:
-                            return (bi*3+bj, v, f"行{row+1}", affected)
-                    cols = set(j for (i, j) in positions)
-                    if len(cols) == 1:
-                        col = next(iter(cols))
-                        affected = []
-                        for i2 in range(9):
-                            if (i2, col) not in positions and (i2//3 == bi and col//3 == bj):
-                                continue
-                            if (i2, col) not in positions and v in self.candidates[i2][col] and i2//3 != bi:
-                                self.candidates[i2][col].discard(v)
-                                affected.append((i2, col))
-                        if affected:
-                            return (bi*3+bj, v, f"列{col+1}", affected)
+                    changed = []
+                    for (i, j) in positions[a]:
+                        orig = set(self.candidates[i][j])
+                        if orig != set([a, b]):
+                            self.candidates[i][j].intersection_update([a, b])
+                            changed.append((i, j, orig))
+                    if changed:
+                        scope, idx = self.graph.house_names[h]
+                        return (scope, idx, positions[a], (a, b), changed)
         return None
 
-    def find_box_line_reduction(self):
-        for i in range(9):
-            for v in range(1, 10):
-                positions = [j for j in range(9) if v in self.candidates[i][j]]
-                if not positions:
-                    continue
-                boxes = set(j//3 for j in positions)
-                if len(boxes) == 1:
-                    bj = next(iter(boxes))
-                    affected = []
-                    for di in range(3):
-                        for dj in range(3):
-                            ii, jj = (i//3)*3+di, bj*3+dj
-                            if ii == i:
-                                continue
-                            if v in self.candidates[ii][jj]:
-                                self.candidates[ii][jj].discard(v)
-                                affected.append((ii, jj))
-                    if affected:
-                        return ("行", i, v, affected)
-        for j in range(9):
+    def _find_locked_candidates(self, from_lines):
+        """
+        区块删减的通用形式：某宫A内数字v的所有位置都落在另一宫B中，
+        则从B中A以外的格子消除v。from_lines为True时A取行/列、B取非线的宫（Box/Line Reduction），
+        否则A取宫等非线的宫、B取任意其它宫（Pointing）。
+        """
+        g = self.graph
+        for h, cells in enumerate(g.houses):
+            if g.is_line(h) != from_lines:
+                continue
             for v in range(1, 10):
-                positions = [i for i in range(9) if v in self.candidates[i][j]]
+                positions = [(i, j) for (i, j) in cells if v in self.candidates[i][j]]
                 if not positions:
                     continue
-                boxes = set(i//3 for i in positions)
-                if len(boxes) == 1:
-                    bi = next(iter(boxes))
+                shared = set(g.cell_houses[positions[0][0]][positions[0][1]])
+                for (i, j) in positions[1:]:
+                    shared.intersection_update(g.cell_houses[i][j])
+                shared.discard(h)
+                for h2 in sorted(shared):
+                    if from_lines and g.is_line(h2):
+                        continue
                     affected = []
-                    for di in range(3):
-                        for dj in range(3):
-                            ii, jj = bi*3+di, (j//3)*3+dj
-                            if jj == j:
-                                continue
-                            if v in self.candidates[ii][jj]:
-                                self.candidates[ii][jj].discard(v)
-                                affected.append((ii, jj))
+                    for (ii, jj) in g.houses[h2]:
+                        if (ii, jj) not in positions and v in self.candidates[ii][jj]:
+                            self.candidates[ii][jj].discard(v)
+                            affected.append((ii, jj))
                     if affected:
-                        return ("列", j, v, affected)
+                        return (h, v, h2, affected)
         return None
 
+    def find_pointing_pairs_triples(self):
+        return self._find_locked_candidates(from_lines=False)
+
+    def find_box_line_reduction(self):
+        return self._find_locked_candidates(from_lines=True)
+
 
     def safe_discard(self, i, j, v):
         """
@@ -318,16 +457,71 @@ class SudokuBoard:
 
     def _is_safe(self, i, j, v):
         """判断v能否填入(i,j)"""
-        for k in range(9):
-            if self.board[i][k] == v or self.board[k][j] == v:
+        for (pi, pj) in self.graph.peers[i][j]:
+            if self.board[pi][pj] == v:
+                return False
+        for c in self.graph.constraints:
+            if not c.is_valid(self.board, i, j, v):
                 return False
-        bi, bj = i // 3 * 3, j // 3 * 3
-        for di in range(3):
-            for dj in range(3):
-                if self.board[bi+di][bj+dj] == v:
-                    return False
         return True
 
+    def find_solutions(self, limit=2, should_stop=None):
+        """
+        按约束图做MRV回溯搜索（只依据已填数字，不使用盘面上的候选排除），
+        最多返回limit个解，每个解为9x9列表。
+        should_stop为可选的回调，搜索中返回True时立即中止，此时返回None。
+        """
+        peers = self.graph.peers
+        constraints = self.graph.constraints
+        board = [row[:] for row in self.board]
+        candidates = SudokuBoard(board, self.graph).candidates
+        empties = [(i, j) for i in range(9) for j in range(9) if board[i][j] == 0]
+        solutions = []
+        stopped = []
+        def dfs(idx):
+            if len(solutions) >= limit or stopped:
+                return
+            if should_stop and should_stop():
+                stopped.append(True)
+                return
+            if idx == len(empties):
+                solutions.append([row[:] for row in board])
+                return
+            # MRV: 找候选数最少的格
+            min_cand, min_pos = 10, -1
+            for k in range(idx, len(empties)):
+                i, j = empties[k]
+                if len(candidates[i][j]) < min_cand:
+                    min_cand = len(candidates[i][j])
+                    min_pos = k
+            if min_pos != idx:
+                empties[idx], empties[min_pos] = empties[min_pos], empties[idx]
+            i, j = empties[idx]
+            for v in sorted(candidates[i][j]):
+                if constraints and not all(c.is_valid(board, i, j, v) for c in constraints):
+                    continue
+                # 记录影响
+                affected = []
+                board[i][j] = v
+                for (pi, pj) in peers[i][j]:
+                    if v in candidates[pi][pj]:
+                        candidates[pi][pj].remove(v)
+                        affected.append((pi, pj, v))
+                for c in constraints:
+                    for (ci, cj, d) in c.eliminations(board, candidates, i, j, v):
+                        if d in candidates[ci][cj]:
+                            candidates[ci][cj].remove(d)
+                            affected.append((ci, cj, d))
+                dfs(idx+1)
+                # 回溯
+                board[i][j] = 0
+                for pi, pj, d in affected:
+                    candidates[pi][pj].add(d)
+            if min_pos != idx:
+                empties[idx], empties[min_pos] = empties[min_pos], empties[idx]
+        dfs(0)
+        return None if stopped else solutions
+
     def bowmans_bingo_step(self, i, j, v):
         """
         教学分步Bowman's Bingo：假设(i,j)=v，分步推理，记录推理链，遇矛盾则排除候选。
@@ -383,7 +577,7 @@ class SudokuBoard:
                 bi, bj = i // 3, j // 3
                 msg = f"Hidden Single: {v}在第{bi*3+1}-{bi*3+3}行,第{bj*3+1}-{bj*3+3}列(宫)只出现一次，填写{v}。"
             else:
-                msg = f"Hidden Single: {v}在第{i+1}行第{j+1}列/宫只出现一次，填写{v}。"
+                msg = f"Hidden Single: {v}在{typ}只出现一次，填写{v}。"
             if not silent:
                 print(msg)
             if log is not None:
@@ -409,8 +603,9 @@ class SudokuBoard:
             return True
         move = self.find_pointing_pairs_triples()
         if move:
-            boxidx, v, scope, affected = move
-            msg = f"Pointing Pairs/Triples: 宫{boxidx+1}内数字{v}仅在{scope}出现，从该{scope}宫外格子中消除{v}，影响: {[f'({i+1},{j+1})' for (i,j) in affected]}"
+            h, v, h2, affected = move
+            house, scope, kind = self.graph.house_label(h), self.graph.house_label(h2), self.graph.house_names[h][0]
+            msg = f"Pointing Pairs/Triples: {house}内数字{v}仅在{scope}出现，从该{scope}{kind}外格子中消除{v}，影响: {[f'({i+1},{j+1})' for (i,j) in affected]}"
             if not silent:
                 print(msg)
             if log is not None:
@@ -418,8 +613,9 @@ class SudokuBoard:
             return True
         move = self.find_box_line_reduction()
         if move:
-            scope, idx, v, affected = move
-            msg = f"Box/Line Reduction: {scope}{idx+1}内数字{v}仅在同一宫出现，从该宫其它格子中消除{v}，影响: {[f'({i+1},{j+1})' for (i,j) in affected]}"
+            h, v, h2, affected = move
+            line, kind = self.graph.house_label(h), self.graph.house_names[h2][0]
+            msg = f"Box/Line Reduction: {line}内数字{v}仅在同一{kind}出现，从该{kind}其它格子中消除{v}，影响: {[f'({i+1},{j+1})' for (i,j) in affected]}"
             if not silent:
                 print(msg)
             if log is not None:
@@ -442,6 +638,213 @@ class SudokuGame:
     def __init__(self):
         self.history = []
         self.board = None
+        self.log = []
+        self.givens = None
+        self.generation = 0
+        self.solution = None
+        self.solved = True
+        self.trace = {}
+        self.unchecked = []
+        self._lock = threading.Lock()
+        self._pending = None
+        self._busy = False
+
+    def _new_puzzle(self, solution=None, analyze=True):
+        """
+        换题（加载、输入或恢复会话）后清空缓存，已知唯一解时直接沿用。
+        analyze为True时立即在后台求解并推演，否则等第一次step/set需要时再开始。
+        """
+        with self._lock:
+            self.generation += 1
+            self.solution = solution
+            self.solved = solution is not None or not self.givens
+            self.trace = {}
+        self.unchecked = []
+        if self.board and analyze:
+            self._request_analysis()
+
+    def _request_analysis(self):
+        """
+        请求从当前盘面推演基础策略轨迹。同一时间只有一个后台线程，
+        忙碌时只记下最新的盘面，由该线程处理完手头的工作后接着处理。
+        """
+        with self._lock:
+            self._pending = (self.board.to_bytes(), self.board.graph, self.generation)
+            if self._busy:
+                return
+            self._busy = True
+        threading.Thread(target=self._analyze, daemon=True).start()
+
+    def _analyze(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._pending is None:
+                        self._busy = False
+                        return
+                    (root, graph, generation), self._pending = self._pending, None
+                    if generation != self.generation:
+                        continue
+                    trace, givens, solved = self.trace, self.givens, self.solved
+
+                def stale():
+                    return generation != self.generation
+                if not solved:
+                    self._solve(generation, givens, graph, stale)
+                self._replay(root, graph, trace, stale)
+        except BaseException:
+            with self._lock:
+                self._busy = False
+            raise
+
+    def _solve(self, generation, givens, graph, stale):
+        """
+        从题目的原始数字求唯一解，无论成功与否都标记为已求解，避免核对一直等待。
+        换题后搜索立即中止，不会拖住新题目。
+        """
+        solution = None
+        try:
+            if givens:
+                solutions = SudokuBoard(givens, graph).find_solutions(limit=2, should_stop=stale)
+                if solutions and len(solutions) == 1:
+                    solution = solutions[0]
+        finally:
+            with self._lock:
+                if generation == self.generation:
+                    self.solution, self.solved = solution, True
+
+    @staticmethod
+    def _replay(root, graph, trace, stale):
+        """
+        从root盘面逐步推演并写入trace（以盘面快照为键，记录该步说明和执行后的盘面），
+        走到已推演过的盘面或换题后即停止。trace按题目各自独立，旧线程的写入不会混入新题。
+        """
+        board = SudokuBoard.from_bytes(root, graph=graph)
+        before = root
+        while before not in trace and not stale():
+            msgs = []
+            if not board.do_one_step(silent=True, log=msgs):
+                break
+            after = board.to_bytes()
+            trace[before] = (msgs[0], after)
+            before = after
+
+    def _check_moves(self):
+        """唯一解已算出时核对尚未核对的填数，解还没算出就留到下一条命令，从不等待。"""
+        if not self.solved or not self.unchecked:
+            return
+        for (r, c, v) in self.unchecked:
+            if self.solution and self.board and self.board.board[r][c] == v and self.solution[r][c] != v:
+                print(f"注意：{v}与唯一解不符，第{r+1}行第{c+1}列填错了！")
+        self.unchecked = []
+
+    def _cached_step(self):
+        """执行一步基础策略：盘面在预推演轨迹上时直接取结果，否则现场推理并请求从新盘面推演。"""
+        cached = self.trace.get(self.board.to_bytes())
+        if cached is None:
+            changed = self.board.do_one_step(log=self.log)
+            if changed:
+                self._request_analysis()
+            return changed
+        msg, after = cached
+        self.board = SudokuBoard.from_bytes(after, graph=self.board.graph)
+        print(msg)
+        self.log.append(msg)
+        return True
+
+    def snapshot(self):
+        """
+        把整个会话（约束、题目原始数字及已算出的唯一解、盘面与候选数、撤销历史、推理日志）
+        打包为二进制快照。撤销历史本身就以to_bytes格式保存，直接拼接，只有当前盘面需要编码。
+        """
+        flags = (1 if self.givens else 0) | (2 if self.solution else 0)
+        parts = [struct.pack('<4sB', SNAPSHOT_MAGIC, SNAPSHOT_VERSION),
+                 self.board.graph.to_bytes(),
+                 struct.pack('<B', flags)]
+        if self.givens:
+            parts.append(bytes(itertools.chain.from_iterable(self.givens)))
+        if self.solution:
+            parts.append(bytes(itertools.chain.from_iterable(self.solution)))
+        parts.append(struct.pack('<I', len(self.history)))
+        parts.append(self.board.to_bytes())
+        parts.extend(self.history)
+        parts.append(struct.pack('<I', len(self.log)))
+        for msg in self.log:
+            raw = msg.encode('utf-8')
+            parts.append(struct.pack('<I', len(raw)))
+            parts.append(raw)
+        return b''.join(parts)
+
+    def restore(self, data):
+        """
+        从snapshot()生成的快照还原会话，数据不完整、有多余内容或版本不符时抛出ValueError。
+        撤销历史只校验不解码，撤销时再还原成盘面。快照里有唯一解就直接沿用，
+        否则在后台从题目原始数字重新求解（而不是从可能已填错的当前盘面）。
+        """
+        try:
+            magic, version = struct.unpack_from('<4sB', data, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError('不是数独会话快照')
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f'不支持的快照版本: {version}')
+            graph, offset = ConstraintGraph.from_bytes(data, 5)
+            (flags,) = struct.unpack_from('<B', data, offset)
+            offset += 1
+            grids = []
+            for bit in (1, 2):
+                if not flags & bit:
+                    grids.append(None)
+                    continue
+                raw = bytes(data[offset:offset+81])
+                if len(raw) != 81 or max(raw) > 9:
+                    raise ValueError('快照中的题目数据无效')
+                grids.append([list(raw[r*9:r*9+9]) for r in range(9)])
+                offset += 81
+            (count,) = struct.unpack_from('<I', data, offset)
+            offset += 4
+            board = SudokuBoard.from_bytes(data, offset, graph)
+            offset += BOARD_FORMAT.size
+            history = []
+            for _ in range(count):
+                SudokuBoard.unpack_values(data, offset)
+                history.append(bytes(data[offset:offset+BOARD_FORMAT.size]))
+                offset += BOARD_FORMAT.size
+            (count,) = struct.unpack_from('<I', data, offset)
+            offset += 4
+            log = []
+            for _ in range(count):
+                (n,) = struct.unpack_from('<I', data, offset)
+                offset += 4
+                if offset + n > len(data):
+                    raise ValueError('快照数据不完整')
+                log.append(bytes(data[offset:offset+n]).decode('utf-8'))
+                offset += n
+        except struct.error as e:
+            raise ValueError(f'快照数据不完整: {e}') from e
+        if offset != len(data):
+            raise ValueError('快照末尾有多余数据')
+        self.board, self.history, self.log = board, history, log
+        self.givens = grids[0]
+        self._new_puzzle(grids[1], analyze=False)
+
+    def save_session(self, filename):
+        if not self.board:
+            print("请先输入数独题目（input命令）后再保存。")
+            return
+        try:
+            with open(filename, 'wb') as f:
+                f.write(self.snapshot())
+            print(f'会话已保存到 {filename}')
+        except Exception as e:
+            print(f'保存失败: {e}')
+
+    def load_session(self, filename):
+        try:
+            with open(filename, 'rb') as f:
+                self.restore(f.read())
+            print(f'已从 {filename} 恢复会话。')
+        except Exception as e:
+            print(f'恢复失败: {e}')
 
     def save_puzzle(self, filename):
         if not self.board:
@@ -476,6 +879,9 @@ class SudokuGame:
                 board.append(row)
             self.board = SudokuBoard(board)
             self.history = []
+            self.log = []
+            self.givens = board
+            self._new_puzzle()
             print(f'已从 {filename} 加载。')
         except Exception as e:
             print(f'加载失败: {e}')
@@ -523,6 +929,9 @@ class SudokuGame:
                 continue
             self.board = SudokuBoard(board)
             self.history = []
+            self.log = []
+            self.givens = board
+            self._new_puzzle()
             print("谜题输入完成。")
             break
 
@@ -532,7 +941,7 @@ class SudokuGame:
  input          输入新的数独题目
  show           显示当前棋盘
  candidates     显示所有格子的候选数
- set r c v      在第r行第c列填入数字v（1-9）
+ set r c v      在第r行第c列填入数字v（1-9），与唯一解不符时提示填错
  step           自动应用一步基础策略
  solve          自动求解到不能再用基础策略
  bingo r c v    尝试在第r行第c列填入数字v（1-9），有矛盾则消除第r行第c列的候选数字v,无矛盾且数独已经解决则将解出来的数独显示出来
@@ -540,6 +949,8 @@ class SudokuGame:
  reset          重新输入谜题
  save 文件名    保存当前数独到文件
  load 文件名    从文件加载数独
+ snapshot 文件名 保存整个会话（候选数、撤销历史、推理日志）的二进制快照
+ resume 文件名  从二进制快照恢复会话
  help           显示帮助
  exit           退出程序
         """)
@@ -554,6 +965,7 @@ class SudokuGame:
         self.show_help()
         while True:
             cmd = input("请输入命令(help查看帮助): ").strip().lower()
+            self._check_moves()
             if cmd == 'input':
                 self.input_puzzle()
             elif cmd == 'show':
@@ -578,24 +990,27 @@ class SudokuGame:
                     if self.board.board[r][c] != 0:
                         print("该格已填写！")
                         continue
-                    self.history.append(self.board.clone())
+                    self.history.append(self.board.to_bytes())
                     self.board.set_cell(r, c, v)
                     print(f"已在第{r+1}行第{c+1}列填写{v}")
+                    self.unchecked.append((r, c, v))
+                    self._check_moves()
+                    self._request_analysis()
                 except Exception as e:
                     print("命令格式错误，应为 set r c v")
             elif cmd == 'step':
                 if not self.require_board():
                     continue
-                self.history.append(self.board.clone())
+                self.history.append(self.board.to_bytes())
                 if self.board:
-                    self.board.do_one_step()
+                    self._cached_step()
             elif cmd == 'solve':
                 if not self.require_board():
                     continue
-                self.history.append(self.board.clone())
+                self.history.append(self.board.to_bytes())
                 step_count = 0
                 while True:
-                    changed = self.board.do_one_step(silent=False) if self.board else False
+                    changed = self._cached_step() if self.board else False
                     if changed:
                         step_count += 1
                         continue
@@ -606,64 +1021,11 @@ class SudokuGame:
                     continue
                 import time
                 start = time.time()
-                board = [row[:] for row in self.board.board]
-                # 预处理候选数
-                candidates = [[set(range(1, 10)) if board[i][j] == 0 else set() for j in range(9)] for i in range(9)]
-                for i in range(9):
-                    for j in range(9):
-                        if board[i][j]:
-                            v = board[i][j]
-                            for k in range(9):
-                                candidates[i][k].discard(v)
-                                candidates[k][j].discard(v)
-                            bi, bj = i // 3 * 3, j // 3 * 3
-                            for di in range(3):
-                                for dj in range(3):
-                                    candidates[bi+di][bj+dj].discard(v)
-                empties = [(i, j) for i in range(9) for j in range(9) if board[i][j] == 0]
-                solutions = []
-                def dfs(idx):
-                    if len(solutions) > 1:
-                        return
-                    if idx == len(empties):
-                        solutions.append([row[:] for row in board])
-                        return
-                    # MRV: 找候选数最少的格
-                    min_cand, min_pos = 10, -1
-                    for k in range(idx, len(empties)):
-                        i, j = empties[k]
-                        if len(candidates[i][j]) < min_cand:
-                            min_cand = len(candidates[i][j])
-                            min_pos = k
-                    if min_pos != idx:
-                        empties[idx], empties[min_pos] = empties[min_pos], empties[idx]
-                    i, j = empties[idx]
-                    for v in sorted(candidates[i][j]):
-                        # 记录影响
-                        affected = []
-                        board[i][j] = v
-                        for k in range(9):
-                            if v in candidates[i][k]:
-                                candidates[i][k].remove(v)
-                                affected.append((i, k))
-                            if v in candidates[k][j]:
-                                candidates[k][j].remove(v)
-                                affected.append((k, j))
-                        bi, bj = i // 3 * 3, j // 3 * 3
-                        for di in range(3):
-                            for dj in range(3):
-                                ii, jj = bi+di, bj+dj
-                                if v in candidates[ii][jj]:
-                                    candidates[ii][jj].remove(v)
-                                    affected.append((ii, jj))
-                        dfs(idx+1)
-                        # 回溯
-                        board[i][j] = 0
-                        for ii, jj in affected:
-                            candidates[ii][jj].add(v)
-                    if min_pos != idx:
-                        empties[idx], empties[min_pos] = empties[min_pos], empties[idx]
-                dfs(0)
+                if self.solution and all(v in (0, s) for row, srow in zip(self.board.board, self.solution) for v, s in zip(row, srow)):
+                    # 盘面与题目的唯一解一致，当前盘面的解也就是它
+                    solutions = [self.solution]
+                else:
+                    solutions = self.board.find_solutions(limit=2)
                 if not solutions:
                     print("无解。耗时{:.3f}s".format(time.time()-start))
                 else:
@@ -679,19 +1041,26 @@ class SudokuGame:
                 if not self.require_board():
                     continue
                 if self.history:
-                    self.board = self.history.pop()
+                    self.board = SudokuBoard.from_bytes(self.history.pop(), graph=self.board.graph)
                     print("已撤销上一步。")
                 else:
                     print("没有可撤销的操作。")
             elif cmd == 'reset':
                 self.board = None
                 self.history = []
+                self.log = []
+                self.givens = None
+                self._new_puzzle()
                 print("已重置，等待输入新命令。")
             elif cmd.startswith('save '):
                 _, filename = cmd.split(maxsplit=1)
                 self.save_puzzle(filename)
             elif cmd.startswith('load '):
                 self.load_puzzle(cmd.split(maxsplit=1)[1])
+            elif cmd.startswith('snapshot '):
+                self.save_session(cmd.split(maxsplit=1)[1])
+            elif cmd.startswith('resume '):
+                self.load_session(cmd.split(maxsplit=1)[1])
             elif cmd == 'help':
                 self.show_help()
             elif cmd == 'exit':
@@ -712,6 +1081,8 @@ class SudokuGame:
                         continue
                     if self.board:
                         log = self.board.bowmans_bingo_step(i, j, v)
+                        self.log.extend(log)
+                        self._request_analysis()
                         print("\n".join(log))
                 except Exception as e:
                     print("命令格式错误，应为 bingo i j v")
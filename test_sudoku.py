@@ -0,0 +1,287 @@
+import os
+import time
+
+import pytest
+
+from sudoku import (SudokuBoard, SudokuGame, Constraint, ConstraintGraph, Diagonal, Windoku, KillerCage, NonConsecutive,
+                    _compile_graph)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+POINTING_PUZZLE = "000801000000000430500000000000070800000000100020030000600000075400300000000200600"
+
+# 以下推理日志来自约束图重构之前的实现，经典数独的推理过程和文字应保持不变
+SAMPLE_LOG = [
+    'Naked Single: 在第6行第4列唯一候选为3，填写3。',
+    'Naked Single: 在第7行第4列唯一候选为1，填写1。',
+    'Naked Single: 在第9行第4列唯一候选为7，填写7。',
+    'Naked Single: 在第1行第4列唯一候选为8，填写8。',
+    'Naked Single: 在第3行第4列唯一候选为9，填写9。',
+    'Hidden Single: 1在第2行只出现一次，填写1。',
+    'Hidden Single: 6在第2行只出现一次，填写6。',
+    'Hidden Single: 7在第5行只出现一次，填写7。',
+    'Hidden Single: 8在第5行只出现一次，填写8。',
+    'Hidden Single: 8在第2行只出现一次，填写8。',
+    'Hidden Single: 8在第4行只出现一次，填写8。',
+    'Hidden Single: 8在第8行只出现一次，填写8。',
+    'Hidden Single: 1在第9行只出现一次，填写1。',
+    'Hidden Single: 2在第5列只出现一次，填写2。',
+    'Hidden Single: 9在第9列只出现一次，填写9。',
+    'Hidden Single: 5在第1-3行,第7-9列(宫)只出现一次，填写5。',
+    "Naked Pairs: 行2 的格[(2, 9), (2, 8)] 仅有候选(3, 4)，从同行其它格中消除(3, 4)，影响: ['(2,1)去除4', '(2,3)去除4']",
+    "Naked Pairs: 列8 的格[(5, 8), (2, 8)] 仅有候选(3, 4)，从同列其它格中消除(3, 4)，影响: ['(6,8)去除4', '(8,8)去除3']",
+    "Naked Pairs: 宫1 的格[(2, 3), (2, 1)] 仅有候选(7, 9)，从同宫其它格中消除(7, 9)，影响: ['(1,1)去除7', '(3,3)去除7']",
+    "Naked Pairs: 宫3 的格[(2, 9), (2, 8)] 仅有候选(3, 4)，从同宫其它格中消除(3, 4)，影响: ['(1,7)去除3', '(1,7)去除4', '(3,7)去除4']",
+    "Naked Pairs: 列7 的格[(3, 7), (1, 7)] 仅有候选(2, 7)，从同列其它格中消除(2, 7)，影响: ['(4,7)去除2', '(6,7)去除2', '(8,7)去除2']",
+    "Pointing Pairs/Triples: 宫4内数字3仅在列1出现，从该列1宫外格子中消除3，影响: ['(8,1)']",
+    "Pointing Pairs/Triples: 宫8内数字6仅在行7出现，从该行7宫外格子中消除6，影响: ['(7,7)']",
+    '无可用策略。',
+]
+
+POINTING_LOG = [
+    'Hidden Single: 3在第6列只出现一次，填写3。',
+    'Hidden Single: 3在第7列只出现一次，填写3。',
+    'Hidden Single: 2在第7行只出现一次，填写2。',
+    "Pointing Pairs/Triples: 宫3内数字5仅在行1出现，从该行1宫外格子中消除5，影响: ['(1,5)']",
+    "Pointing Pairs/Triples: 宫5内数字1仅在列4出现，从该列4宫外格子中消除1，影响: ['(7,4)']",
+    "Pointing Pairs/Triples: 宫8内数字7仅在列6出现，从该列6宫外格子中消除7，影响: ['(2,6)']",
+    "Pointing Pairs/Triples: 宫9内数字4仅在行9出现，从该行9宫外格子中消除4，影响: ['(9,5)', '(9,6)']",
+    '无可用策略。',
+]
+
+
+def parse(text):
+    digits = [0 if ch in '.0' else int(ch) for ch in text if ch in '.0123456789']
+    return [digits[r*9:r*9+9] for r in range(9)]
+
+
+def run_log(board):
+    log = []
+    while board.do_one_step(silent=True, log=log):
+        pass
+    return log
+
+
+def check_solution(solution, graph):
+    for cells in graph.houses:
+        assert sorted(solution[i][j] for (i, j) in cells) == list(range(1, 10))
+    for i in range(9):
+        for j in range(9):
+            for (pi, pj) in graph.peers[i][j]:
+                assert solution[pi][pj] != solution[i][j]
+            for c in graph.constraints:
+                assert c.is_valid(solution, i, j, solution[i][j])
+
+
+def test_classic_trace_matches_baseline():
+    with open(os.path.join(HERE, 'sample'), encoding='utf-8') as f:
+        assert run_log(SudokuBoard(parse(f.read()))) == SAMPLE_LOG
+    assert run_log(SudokuBoard(parse(POINTING_PUZZLE))) == POINTING_LOG
+
+
+def test_box_line_reduction_message():
+    b = SudokuBoard()
+    for j in range(2, 9):
+        b.candidates[0][j].discard(5)
+    for (i, j) in [(1, 1), (1, 2), (2, 0), (2, 1)]:
+        b.candidates[i][j].discard(5)
+    log = []
+    assert b.do_one_step(silent=True, log=log)
+    assert log == ["Box/Line Reduction: 行1内数字5仅在同一宫出现，从该宫其它格子中消除5，影响: ['(2,1)', '(3,3)']"]
+
+
+def test_variant_solves():
+    cages = [KillerCage(3, [(0, 0), (0, 1)]), KillerCage(24, [(1, 0), (1, 1), (2, 0)]), KillerCage(17, [(8, 7), (8, 8)])]
+    for constraints in ([Diagonal()], [Windoku()], [Diagonal(), Windoku()], cages):
+        graph = ConstraintGraph(constraints)
+        solutions = SudokuBoard(None, graph).find_solutions(limit=1)
+        assert len(solutions) == 1
+        check_solution(solutions[0], graph)
+        assert all(sum(solutions[0][i][j] for (i, j) in c.cells) == c.total for c in graph.constraints if isinstance(c, KillerCage))
+
+
+def test_non_consecutive_solve():
+    graph = ConstraintGraph([NonConsecutive()])
+    solution = parse("135247968792683514468159372624971835381524697957368241573816429816492753249735186")
+    check_solution(solution, graph)
+    puzzle = [[v if (i + j) % 2 else 0 for j, v in enumerate(row)] for i, row in enumerate(solution)]
+    board = SudokuBoard(puzzle, graph)
+    assert board.find_solutions(limit=2) == [solution]
+
+
+def killer_cages(solution):
+    # 每行按两格一组划分笼子，和取自已知解
+    return [KillerCage(solution[i][2*k] + solution[i][2*k+1], [(i, 2*k), (i, 2*k+1)]) for i in range(9) for k in range(4)]
+
+
+CLASSIC_SOLUTION = "123456789456789123789123456261934875834517692597268314312675948645891237978342561"
+
+# (约束, 题目, 已知解)
+VARIANT_PUZZLES = [
+    (lambda: [Diagonal()], None, None),
+    (lambda: [Windoku()],
+     "020000009456009000000003405001000070060005904005900000002007300000600800000530000",
+     "123456789456789123789213465941368572867125934235974618512847396374692851698531247"),
+    (lambda: killer_cages(parse(CLASSIC_SOLUTION)),
+     "020000009456000000000003406001000070030007602007200000000000900000000200000340000",
+     CLASSIC_SOLUTION),
+    (lambda: [NonConsecutive()],
+     "030000006468000000000006103006000090070004801003900000000000600000000900000460000",
+     "135279486468513729792846153246381597579624831813957264351792648684135972927468315"),
+]
+
+
+def check_steps(board, solution):
+    """逐步执行策略，每一步后已填数字都须与解一致，解中的数字也不能被排除。"""
+    log = []
+    while True:
+        for i in range(9):
+            for j in range(9):
+                if board.board[i][j]:
+                    assert board.board[i][j] == solution[i][j], log[-1:]
+                else:
+                    assert solution[i][j] in board.candidates[i][j], log[-1:]
+        if not board.do_one_step(silent=True, log=log):
+            return log
+
+
+def test_variant_strategies_agree_with_solution():
+    for make_constraints, puzzle, solution in VARIANT_PUZZLES:
+        graph = ConstraintGraph(make_constraints())
+        if puzzle is None:
+            solution = SudokuBoard(None, graph).find_solutions(limit=1)[0]
+            puzzle = [[v if (i * 9 + j) % 2 else 0 for j, v in enumerate(row)] for i, row in enumerate(solution)]
+        else:
+            puzzle, solution = parse(puzzle), parse(solution)
+        check_solution(solution, graph)
+        log = check_steps(SudokuBoard(puzzle, graph), solution)
+        assert len(log) > 10
+
+
+def test_window_locked_candidates():
+    _, puzzle, solution = VARIANT_PUZZLES[1]
+    log = check_steps(SudokuBoard(parse(puzzle), ConstraintGraph([Windoku()])), parse(solution))
+    assert "Pointing Pairs/Triples: 宫3内数字2仅在窗口2出现，从该窗口2宫外格子中消除2，影响: ['(4,6)']" in log
+
+
+def test_variant_candidate_pruning():
+    solution = parse(CLASSIC_SOLUTION)
+    board = SudokuBoard(None, ConstraintGraph(killer_cages(solution)))
+    # 第1行前两格的笼子和为3，只能填1、2
+    assert board.candidates[0][0] == {1, 2}
+    board = SudokuBoard(None, ConstraintGraph([NonConsecutive()]))
+    board.set_cell(4, 4, 5)
+    assert board.candidates[3][4] == {1, 2, 3, 7, 8, 9}
+    assert board.candidates[3][3] == {1, 2, 3, 4, 6, 7, 8, 9}
+
+
+def test_killer_cage_validation():
+    for total, cells in ((10, [(0, 0), (0, 0)]), (10, [(0, 9)]), (300, [(0, 0), (0, 1)]), (5, [])):
+        with pytest.raises(ValueError):
+            KillerCage(total, cells)
+
+
+def make_session():
+    game = SudokuGame()
+    with open(os.path.join(HERE, 'sample'), encoding='utf-8') as f:
+        game.board = SudokuBoard(parse(f.read()), ConstraintGraph([Diagonal(), KillerCage(10, [(0, 0), (0, 1)])]))
+    for _ in range(5):
+        game.history.append(game.board.to_bytes())
+        game.board.do_one_step(silent=True, log=game.log)
+    return game
+
+
+def test_snapshot_round_trip():
+    game = make_session()
+    restored = SudokuGame()
+    restored.restore(game.snapshot())
+    assert restored.board.board == game.board.board
+    assert restored.board.candidates == game.board.candidates
+    assert restored.history == game.history
+    assert restored.log == game.log
+    assert [type(c) for c in restored.board.graph.constraints] == [Diagonal, KillerCage]
+
+
+def test_snapshot_rejects_bad_data():
+    data = make_session().snapshot()
+    for bad in (b'', data[:100], data + b'x', b'XXXX' + data[4:]):
+        with pytest.raises(ValueError):
+            SudokuGame().restore(bad)
+
+
+def test_snapshot_unregistered_constraint():
+    class Custom(Constraint):
+        pass
+    game = SudokuGame()
+    game.board = SudokuBoard(None, ConstraintGraph([Custom()]))
+    with pytest.raises(ValueError):
+        game.snapshot()
+
+
+def wait_solved(game, timeout=10):
+    deadline = time.time() + timeout
+    while not game.solved:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_resume_checks_moves_against_original_puzzle():
+    game = SudokuGame()
+    game.load_puzzle(os.path.join(HERE, 'sample'))
+    wait_solved(game)
+    solution = game.solution
+    game.board.set_cell(0, 0, 1)
+    data = game.snapshot()
+
+    restored = SudokuGame()
+    restored.restore(data)
+    assert restored.solved and restored.solution == solution
+
+    # 快照里没有解时，从题目原始数字重新求解，而不是从已填错的盘面
+    # 恢复本身不启动后台推演，第一次需要时再开始
+    game.solution = None
+    restored = SudokuGame()
+    restored.restore(game.snapshot())
+    assert not restored._busy and not restored.solved
+    restored._request_analysis()
+    wait_solved(restored)
+    assert restored.solution == solution
+
+
+def test_set_check_never_waits_for_solver(capsys):
+    game = SudokuGame()
+    game.load_puzzle(os.path.join(HERE, 'sample'))
+    wait_solved(game)
+    game.solved = False
+    game.unchecked.append((0, 0, 1))
+    game.board.set_cell(0, 0, 1)
+    game._check_moves()
+    assert '填错' not in capsys.readouterr().out
+    game.solved = True
+    game._check_moves()
+    assert '填错' in capsys.readouterr().out
+
+
+def test_graph_cache_reuses_and_is_bounded():
+    data = ConstraintGraph([KillerCage(3, [(0, 0), (0, 1)])]).to_bytes()
+    assert ConstraintGraph.from_bytes(data)[0] is ConstraintGraph.from_bytes(data)[0]
+    for total in range(3, 45):
+        ConstraintGraph.from_bytes(ConstraintGraph([KillerCage(total, [(0, 0), (0, 1), (1, 1), (2, 2), (3, 3)])]).to_bytes())
+    assert _compile_graph.cache_info().currsize <= _compile_graph.cache_info().maxsize
+
+
+def test_stale_search_does_not_block_next_puzzle(tmp_path):
+    # 第1宫放不下1，无解，但盲目搜索要很久才能证明
+    slow = tmp_path / 'slow'
+    slow.write_text('....1....\n.....1...\n.......1.\n' + '.........\n' * 6, encoding='utf-8')
+    game = SudokuGame()
+    game.load_puzzle(str(slow))
+    time.sleep(0.2)
+    assert not game.solved
+    game.load_puzzle(os.path.join(HERE, 'sample'))
+    wait_solved(game)
+    assert game.solution is not None
+
+
+def test_find_solutions_should_stop():
+    assert SudokuBoard().find_solutions(limit=2, should_stop=lambda: True) is None